@@ -1,5 +1,5 @@
 from abc import ABC, abstractmethod
-import numpy as np
+import math
 
 
 class Agent(ABC):
@@ -20,15 +20,55 @@ class Agent(ABC):
     def __init__(self, x: float, y: float, step_size: float) -> None:
 
         # Initiate agent position
-        self.position = (x, y)
+        self._position = (x, y)
         self.step_size = step_size
 
-        # Placeholder for the reference to the agent's friend and enemy
-        self.friend = None
-        self.enemy = None
+        # Placeholders for the environment holding the agent's position
+        # and the agent's row in its position array
+        self.env = None
+        self.idx = None
 
-        self.friend_position = None
-        self.enemy_position = None
+        # Placeholders for the perceived positions of the friend, the enemy
+        # and the agent itself, stored as separate coordinates
+        self.fx, self.fy = None, None
+        self.ex, self.ey = None, None
+        self.px, self.py = None, None
+
+    @property
+    def position(self) -> tuple:
+        """
+        The current position of the agent.
+
+        Returns
+        -------
+        tuple
+            Horizontal and vertical position.
+        """
+        if self.env is None:
+            return self._position
+        x, y = self.env.positions[self.idx].tolist()
+        return (x, y)
+
+    @position.setter
+    def position(self, position: tuple) -> None:
+        if self.env is None:
+            self._position = (position[0], position[1])
+        else:
+            self.env.set_position(self.idx, position)
+
+    def attach(self, env, idx: int) -> None:
+        """
+        Lets the environment hold the agent's position from now on.
+
+        Parameters
+        ----------
+        env : Environment
+            The environment the agent lives in.
+        idx : int
+            The agent's row in the environment's position array.
+        """
+        self.env = env
+        self.idx = idx
 
     def _calculate_point_on_vector(self, destination: tuple) -> tuple:
         """
@@ -44,20 +84,18 @@ class Agent(ABC):
         tuple
             New position where to travel.
         """
-        v = np.array(self.position, dtype=float)
-        u = np.array(destination, dtype=float)
-        n = v - u
-        n_magnitude = np.linalg.norm(n, 2)
-        if n_magnitude == 0:
-            n = 0
-        else:
-            n /= n_magnitude
+        x, y = self.px, self.py
+        dx = x - destination[0]
+        dy = y - destination[1]
 
         # Make sure we don't overstep the destination
-        distance = min(n_magnitude, self.step_size)
-        new_position = v - distance * n
+        n_magnitude = math.hypot(dx, dy)
+        if n_magnitude <= self.step_size:
+            return (destination[0], destination[1])
+
+        inv = self.step_size / n_magnitude
 
-        return new_position
+        return (x - dx*inv, y - dy*inv)
 
     @abstractmethod
     def _get_new_position(self) -> tuple:
@@ -71,12 +109,20 @@ class Agent(ABC):
         """
         pass
 
-    def update_state(self) -> None:
+    def update_state(self, friend_position: tuple, enemy_position: tuple) -> None:
         """
-        Save the position of the friend and the enemy.
+        Save the position of the friend, the enemy and the agent itself.
+
+        Parameters
+        ----------
+        friend_position : tuple
+            The current position of the friend.
+        enemy_position : tuple
+            The current position of the enemy.
         """
-        self.friend_position = self.friend.position
-        self.enemy_position = self.enemy.position
+        self.fx, self.fy = friend_position
+        self.ex, self.ey = enemy_position
+        self.px, self.py = self.position
 
     def move(self) -> None:
         """
@@ -113,9 +159,7 @@ class ProtectiveAgent1(Agent):
         tuple(float, float)
             Position of the midpoint.
         """
-        midpoint_x = (self.friend_position[0] + self.enemy_position[0]) / 2
-        midpoint_y = (self.friend_position[1] + self.enemy_position[1]) / 2
-        return (midpoint_x, midpoint_y)
+        return ((self.fx + self.ex) * 0.5, (self.fy + self.ey) * 0.5)
 
     def _get_new_position(self) -> tuple:
         """
@@ -161,54 +205,29 @@ class ProtectiveAgent2(ProtectiveAgent1):
         tuple
             The destination where to go.
         """
-        # Represent points as vectors
-        f = np.array(self.friend_position, dtype=float)
-        e = np.array(self.enemy_position, dtype=float)
-        p = np.array(self.position, dtype=float)
-
-        # Calculate distance between all points
-        d_fe = np.linalg.norm(f-e, 2)
-        d_fp = np.linalg.norm(f-p, 2)
-        d_ep = np.linalg.norm(e-p, 2)
-
-        # Check if obtuse
-        # Behind friend
-        if d_ep**2 > d_fe**2 + d_fp**2:
-            point = f
-        # Behind enemy
-        elif d_fp**2 > d_fe**2 + d_ep**2:
-            point = e
-        # Between friend and enemy
-        else:
-            # TODO: must be a much neater way of doing all this...
-            # First check if the friend and enemy form a vertical line
-            if e[0]-f[0] == 0:
-                # If so we now that the intercept will happen at their x location
-                # and at self's y location since we already have checked that
-                # self is not outside the line
-                x = e[0]
-                y = self.position[1]
-            # The same case with horizontal lines
-            elif e[1]-f[1] == 0:
-                x = self.position[1]
-                y = e[1]
-            else:
-                # Calculate slope of the two lines (between enemy and friend
-                # and the perpendicular line passing through self position)
-                m1 = (e[1]-f[1])/(e[0]-f[0])
-                m2 = -1/m1
-
-                # Calculate intercept
-                b1 = e[1] - m1*e[0]
-                b2 = p[1] - m2*p[0]
-
-                # Yields intersection point in line
-                x = (b1-b2)/(m2-m1)
-                y = m1*x + b1
-
-            point = (x, y)
-
-        return (point[0] ,point[1])
+        fx, fy = self.fx, self.fy
+        ex, ey = self.ex, self.ey
+        px, py = self.px, self.py
+
+        # Vectors from the friend to the enemy and to self
+        fex = ex - fx
+        fey = ey - fy
+        fpx = px - fx
+        fpy = py - fy
+
+        # No line to stand on if the friend and the enemy coincide
+        denom = fex*fex + fey*fey
+        if denom == 0:
+            return (fx, fy)
+
+        # Project self onto the line through the friend and the enemy,
+        # where t = 0 is the friend and t = 1 is the enemy. Clamping t
+        # takes us to the friend if we are behind the friend and to the
+        # enemy if we are behind the enemy.
+        t = (fpx*fex + fpy*fey) / denom
+        t = min(max(t, 0.0), 1.0)
+
+        return (fx + t*fex, fy + t*fey)
 
 
 class HidingAgent1(ProtectiveAgent1):
@@ -241,25 +260,23 @@ class HidingAgent1(ProtectiveAgent1):
         tuple
             The destination where to go.
         """
-        # Represent points as vectors
-        f = np.array(self.friend_position, dtype=float)
-        e = np.array(self.enemy_position, dtype=float)
+        fx, fy = self.fx, self.fy
+        ex, ey = self.ex, self.ey
 
         # TODO: very similar to ProtectiveAgent1, generalize this
-        v = f - e
-        u = v / np.linalg.norm(v, 2)
+        vx = fx - ex
+        vy = fy - ey
+        d_fe = math.hypot(vx, vy)
 
-        # Check in which direction we should move
-        point = f + self.distance*u
-        d_fe = np.linalg.norm(f-e, 2)
-        d_ep = np.linalg.norm(e-point, 2)
-        
-        # The distance between the new point and the enemy should be
-        # greater than the distance between the friend and the enemy
-        if d_fe > d_ep:
-            point = f - self.distance*u
+        # No line to hide along if the friend and the enemy coincide
+        if d_fe == 0:
+            return (fx, fy)
 
-        return (point[0] ,point[1])
+        # Moving along the vector from the enemy to the friend always takes
+        # us further away from the enemy, so no direction check is needed
+        scale = self.distance / d_fe
+
+        return (fx + scale*vx, fy + scale*vy)
 
 
 class HidingAgent2(ProtectiveAgent1):
@@ -290,52 +307,24 @@ class HidingAgent2(ProtectiveAgent1):
         tuple
             The destination where to go.
         """
-        # Represent points as vectors
-        f = np.array(self.friend_position, dtype=float)
-        e = np.array(self.enemy_position, dtype=float)
-        p = np.array(self.position, dtype=float)
-
-        # Calculate distance between all points
-        d_fe = np.linalg.norm(f-e, 2)
-        d_fp = np.linalg.norm(f-p, 2)
-        d_ep = np.linalg.norm(e-p, 2)
-
-        # TODO: very similar to ProtectiveAgent2, generalize this
-        # Check if obtuse
-        # Behind friend
-        if d_ep**2 > d_fe**2 + d_fp**2:
-            # TODO: must be a much neater way of doing all this...
-            # First check if the friend and enemy form a vertical line
-            if e[0]-f[0] == 0:
-                # If so we now that the intercept will happen at their x location
-                # and at self's y location since we already have checked that
-                # self is not outside the line
-                x = e[0]
-                y = self.position[1]
-            # The same case with horizontal lines
-            elif e[1]-f[1] == 0:
-                x = self.position[1]
-                y = e[1]
-            else:
-                # Calculate slope of the two lines (between enemy and friend
-                # and the perpendicular line passing through self position)
-                m1 = (e[1]-f[1])/(e[0]-f[0])
-                m2 = -1/m1
-
-                # Calculate intercept
-                b1 = e[1] - m1*e[0]
-                b2 = p[1] - m2*p[0]
-
-                # Yields intersection point in line
-                x = (b1-b2)/(m2-m1)
-                y = m1*x + b1
-
-            point = (x, y)
-        # Behind enemy
-        elif d_fp**2 > d_fe**2 + d_ep**2:
-            point = f
-        # Between friend and enemy
-        else:
-            point = f
-
-        return (point[0] ,point[1])
\ No newline at end of file
+        fx, fy = self.fx, self.fy
+        ex, ey = self.ex, self.ey
+        px, py = self.px, self.py
+
+        # Vectors from the friend to the enemy and to self
+        fex = ex - fx
+        fey = ey - fy
+        fpx = px - fx
+        fpy = py - fy
+
+        # Unless we are behind the friend we go to the friend. The sign of
+        # the dot product tells us this without any division, and also
+        # covers a friend and enemy in the same spot.
+        dot = fpx*fex + fpy*fey
+        if dot >= 0:
+            return (fx, fy)
+
+        # Project self onto the line through the friend and the enemy
+        t = dot / (fex*fex + fey*fey)
+
+        return (fx + t*fex, fy + t*fey)
\ No newline at end of file
@@ -1,6 +1,28 @@
 from agent_creator import AgentCreator
+from agent_creator import ProtectiveAgent1Creator
+from agent_creator import ProtectiveAgent2Creator
+from agent_creator import HidingAgent1Creator
+from agent_creator import HidingAgent2Creator
+from kernels import NUMBA_AVAILABLE
+from kernels import CudaSwarm
+from kernels import cuda_available
+from kernels import destination_protective1
+from kernels import destination_protective2
+from kernels import destination_hiding1
+from kernels import destination_hiding2
+from kernels import step_protective1
+from kernels import step_protective2
+from kernels import step_hiding1
+from kernels import step_hiding2
+from kernels import step_protective1_vec
+from kernels import step_protective2_vec
+from kernels import step_hiding1_vec
+from kernels import step_hiding2_vec
+from kernels import allocate_work
+from kernels import set_num_threads
+from functools import partial
+from multiprocessing import get_context
 import numpy as np
-import random
 import matplotlib.pyplot as plt
 from matplotlib.animation import FuncAnimation
 
@@ -21,31 +43,116 @@ class Environment:
         The second number represents the vertical length.
     agent_creator : Implementation of AgentCreator
         Object which produces agents.
+    n_threads : int, optional
+        The number of threads the compiled kernels split the agents over.
+        Uses all available cores if not given. This is numba's setting
+        for the calling thread, so it also applies to every other
+        environment stepped from that thread.
+    use_gpu : bool, optional
+        Whether to move the agents on the GPU, which requires numba and a
+        CUDA capable GPU. Agent types without a kernel still move on the
+        CPU.
     """
 
     def __init__(self, 
             n_agents: int, 
             step_size: float,
             grid_size: tuple,
-            agent_creator: AgentCreator
+            agent_creator: AgentCreator,
+            n_threads: int=None,
+            use_gpu: bool=False
         ) -> None:
         self.n_agents = n_agents
         self.step_size = step_size
         self.grid_size = grid_size
         self.agent_creator = agent_creator
+        self.use_gpu = use_gpu
+
+        if use_gpu and not cuda_available():
+            raise RuntimeError("use_gpu requires numba and a CUDA capable GPU")
+
+        if n_threads is not None:
+            set_num_threads(n_threads)
 
         # Place holder list to store agents
         self.agents = []
 
+        # Place holder for the agents' positions on the GPU, set on reset
+        self._cuda_swarm = None
+
+        # Place holders for the positions of all agents, stored as one row
+        # per agent, and the row indices of each agent's friend and enemy
+        self.positions = np.empty((0, 2), dtype=np.float32)
+        self.friend_idx = np.empty(0, dtype=np.int64)
+        self.enemy_idx = np.empty(0, dtype=np.int64)
+
+        # Update of all agents, specialised to the agent type on reset,
+        # the back buffer it writes the new positions to and its scratch
+        # arrays
+        self._step_kernel = None
+        self._positions_next = np.empty((0, 2), dtype=np.float32)
+        self._work = allocate_work(0, np.float32)
+
+        # Place holder for the scatter plot of the agents and the number
+        # of steps to take between two frames
+        self.sctr = None
+        self.steps_per_frame = 1
+
+    @property
+    def positions(self) -> np.ndarray:
+        """
+        Positions of all agents, one row per agent. When the agents move
+        on the GPU the positions are copied from it on first access after
+        a step.
+
+        Returns
+        -------
+        np.ndarray
+            Array of shape (n_agents, 2).
+        """
+        if self._cuda_swarm is not None and not self._cuda_swarm.synced:
+            self._cuda_swarm.copy_to_host(self._positions)
+        return self._positions
+
+    @positions.setter
+    def positions(self, positions: np.ndarray) -> None:
+        self._positions = positions
+        if self._cuda_swarm is not None:
+            self._cuda_swarm.stale = True
+
+    def set_position(self, idx: int, position: tuple) -> None:
+        """
+        Moves one agent to a new position. When the agents move on the GPU
+        the positions are copied to it before the next step.
+
+        Parameters
+        ----------
+        idx : int
+            Row of the agent in the positions.
+        position : tuple
+            Horizontal and vertical position.
+        """
+        self.positions[idx] = position
+        if self._cuda_swarm is not None:
+            self._cuda_swarm.stale = True
+
     def __random_agent_assignment(self) -> None:
         """
         Assigns an enemy and friend by random sampling with replacements.
         """
-        for i in range(self.n_agents):
-            other_agents = list(range(0 , i)) + list(range(i+1, self.n_agents))
-            friend_idx, enemy_idx = random.sample(other_agents, 2)
-            self.agents[i].friend = self.agents[friend_idx]
-            self.agents[i].enemy = self.agents[enemy_idx]
+        idx = np.arange(self.n_agents)
+
+        # Friends are drawn among the other agents by skipping past self
+        self.friend_idx[:] = np.random.randint(0, self.n_agents-1, size=self.n_agents)
+        self.friend_idx += self.friend_idx >= idx
+
+        # Enemies are drawn among the agents which are neither self nor
+        # the friend by skipping past both, the lower index first
+        low = np.minimum(idx, self.friend_idx)
+        high = np.maximum(idx, self.friend_idx)
+        self.enemy_idx[:] = np.random.randint(0, self.n_agents-2, size=self.n_agents)
+        self.enemy_idx += self.enemy_idx >= low
+        self.enemy_idx += self.enemy_idx >= high
 
     def __neighbours_agent_assignment(self) -> None:
         """
@@ -58,8 +165,96 @@ class Environment:
                 friend_idx, enemy_idx = -2, 0
             else:
                 friend_idx, enemy_idx = i-1, i+1
-            self.agents[i].friend = self.agents[friend_idx]
-            self.agents[i].enemy = self.agents[enemy_idx]
+            self.friend_idx[i] = friend_idx % self.n_agents
+            self.enemy_idx[i] = enemy_idx % self.n_agents
+
+    def __select_step_kernel(self):
+        """
+        Selects the kernel which moves all agents of the type produced by
+        the agent creator. Uses the compiled kernels if numba is available
+        and the numpy kernels otherwise.
+
+        Returns
+        -------
+        callable
+            The kernel, with any constants of the agent type bound to it.
+            Agent types without a kernel are moved one by one.
+        """
+        creator_type = type(self.agent_creator)
+        if NUMBA_AVAILABLE:
+            kernels = {
+                ProtectiveAgent1Creator: step_protective1,
+                ProtectiveAgent2Creator: step_protective2,
+                HidingAgent1Creator: step_hiding1,
+                HidingAgent2Creator: step_hiding2
+            }
+            kwargs = {}
+        else:
+            kernels = {
+                ProtectiveAgent1Creator: step_protective1_vec,
+                ProtectiveAgent2Creator: step_protective2_vec,
+                HidingAgent1Creator: step_hiding1_vec,
+                HidingAgent2Creator: step_hiding2_vec
+            }
+            kwargs = {"work": self._work}
+
+        if creator_type not in kernels:
+            return self.__step_agents
+        if creator_type is HidingAgent1Creator:
+            kwargs["distance"] = self.agent_creator.distance
+        return partial(kernels[creator_type], **kwargs)
+
+    def __step_agents(self, positions, friend_idx, enemy_idx, step_size, out) -> None:
+        """
+        Moves agents of a type without a kernel one by one through their
+        own methods. Has the same signature as the kernels.
+        """
+        # Gather the positions of all friends and enemies at once
+        friend_positions = positions[friend_idx].tolist()
+        enemy_positions = positions[enemy_idx].tolist()
+
+        # All agents update their perceptions simultaneously
+        for agent, friend_position, enemy_position in zip(
+                self.agents, friend_positions, enemy_positions):
+            agent.update_state(friend_position, enemy_position)
+
+        # All agents move simultaneously
+        for agent in self.agents:
+            agent.move()
+
+        out[:] = positions
+
+    def __create_cuda_swarm(self):
+        """
+        Copies the agents to the GPU if there is a GPU kernel for the type
+        produced by the agent creator.
+
+        Returns
+        -------
+        CudaSwarm or None
+            The agents on the GPU, or None if there is no GPU kernel for
+            the agent type.
+        """
+        destinations = {
+            ProtectiveAgent1Creator: destination_protective1,
+            ProtectiveAgent2Creator: destination_protective2,
+            HidingAgent1Creator: destination_hiding1,
+            HidingAgent2Creator: destination_hiding2
+        }
+        creator_type = type(self.agent_creator)
+        if creator_type not in destinations:
+            return None
+
+        distance = 0.0
+        if creator_type is HidingAgent1Creator:
+            distance = self.agent_creator.distance
+        return CudaSwarm(
+            self.positions,
+            self.friend_idx,
+            self.enemy_idx,
+            destinations[creator_type],
+            distance
+        )
 
     def reset(self, assignment_type: str) -> None:
         """
@@ -72,55 +267,77 @@ class Environment:
             How to assign friends and enemies.
             If 'random':
                 Randomly samples with replacement.
-            If 'neighbour':
+            If 'neighbours':
                 Selects previous agent as friend and the next as enemy.
         """
+        # The kernels index the positions with the assignment unchecked, so
+        # an unfilled one must never reach them
+        if assignment_type not in ("random", "neighbours"):
+            raise ValueError(
+                f"Unknown assignment_type {assignment_type!r}, "
+                "expected 'random' or 'neighbours'"
+            )
+
         self.agents = []
+        self._cuda_swarm = None
+        self.friend_idx = np.empty(self.n_agents, dtype=np.int64)
+        self.enemy_idx = np.empty(self.n_agents, dtype=np.int64)
+
+        # Single precision is plenty for positions on the grid and halves
+        # the memory each step has to move
+        self.positions = (
+            np.random.rand(self.n_agents, 2) * self.grid_size
+        ).astype(np.float32)
 
         # Initialize agents and their starting position
-        for _ in range(self.n_agents):
-            x = np.random.rand() * self.grid_size[0]
-            y = np.random.rand() * self.grid_size[1]
-            self.agents.append(
-                self.agent_creator.create_agent(
-                    x=x, 
-                    y=y, 
-                    step_size=self.step_size
-                )
+        for i, (x, y) in enumerate(self.positions.tolist()):
+            agent = self.agent_creator.create_agent(
+                x=x, 
+                y=y, 
+                step_size=self.step_size
             )
 
+            # The agent's position is read from its row of the shared array
+            agent.attach(self, i)
+            self.agents.append(agent)
+
         # Assign a friend and an enemy to each agent
         if assignment_type == "random":
             self.__random_agent_assignment()
         elif assignment_type == "neighbours":
             self.__neighbours_agent_assignment()
 
+        self._positions_next = np.empty_like(self.positions)
+        self._work = allocate_work(self.n_agents, self.positions.dtype)
+        self._step_kernel = self.__select_step_kernel()
+        if self.use_gpu:
+            self._cuda_swarm = self.__create_cuda_swarm()
+
     def step(self) -> None:
         """
         Take one timestep in the environment.
         """
-        # All agents update their perceptions simultaneously
-        for agent in self.agents:
-            agent.update_state()
-
-        # All agents move simultaneously
-        for agent in self.agents:
-            agent.move()
+        if self._cuda_swarm is not None:
+            if self._cuda_swarm.stale:
+                self._cuda_swarm.copy_to_device(self._positions)
+            self._cuda_swarm.step(self.step_size)
+            return
 
-    def format_agent_positions(self) -> np.ndarray:
-        """
-        Formats the agents' positions for plotting.
+        self._step_kernel(
+            self.positions,
+            self.friend_idx,
+            self.enemy_idx,
+            self.step_size,
+            self._positions_next
+        )
 
-        Returns
-        -------
-        np.array
-            A stacked array of all positions.
-        """
-        return np.stack([agent.position for agent in self.agents])
+        # All agents move simultaneously. The kernel only read the current
+        # positions, so the buffers can simply trade places.
+        self.positions, self._positions_next = self._positions_next, self.positions
 
     def render(self, i):
         """
-        Runs and renders one step of the environment.
+        Runs and renders steps_per_frame steps of the environment.
 
         Parameters
         ----------
@@ -129,42 +346,152 @@ class Environment:
 
         Returns
         -------
-        matplotlib.collections.PathCollection
-            A matlotlib scatter plot.
+        tuple of matplotlib.collections.PathCollection
+            The artists to redraw, a matlotlib scatter plot.
         """
-        self.step()
-        positions = self.format_agent_positions()
-        self.sctr.set_offsets(positions)
-        return self.sctr
+        for _ in range(self.steps_per_frame):
+            self.step()
+        self.sctr.set_offsets(self.positions)
+        return (self.sctr,)
 
     def init_render(self):
         """
-        Initial render of the enrivoment.
+        Initial render of the enrivoment. Matplotlib calls this again
+        when the figure is resized, then the existing scatter plot is
+        reused.
 
         Returns
         -------
-        matplotlib.collections.PathCollection
-            A matlotlib scatter plot.
+        tuple of matplotlib.collections.PathCollection
+            The artists to redraw, a matlotlib scatter plot.
         """
-        positions = self.format_agent_positions()
-        self.sctr = plt.scatter(positions[:, 0], positions[:, 1])
-        return self.sctr
-        
-    def run(self, xlim: tuple=None, ylim: tuple=None) -> None:
+        if self.sctr is None:
+            self.sctr = plt.scatter(self.positions[:, 0], self.positions[:, 1])
+        else:
+            self.sctr.set_offsets(self.positions)
+        return (self.sctr,)
+
+    def run_headless(self, n_steps: int) -> None:
+        """
+        Runs the environment without rendering it.
+
+        Parameters
+        ----------
+        n_steps : int
+            The number of steps to take.
+        """
+        for _ in range(n_steps):
+            self.step()
+
+    def run(self, xlim: tuple=None, ylim: tuple=None, steps_per_frame: int=1) -> None:
         """
         Runs the enironment.
+
+        Parameters
+        ----------
+        xlim : tuple, optional
+            Horizontal limits of the plot.
+        ylim : tuple, optional
+            Vertical limits of the plot.
+        steps_per_frame : int, optional
+            The number of steps to take between two frames. Positions are
+            only copied from the GPU once per frame.
         """
+        self.steps_per_frame = steps_per_frame
         fig, ax = plt.subplots()
         if xlim is not None:
             ax.set_xlim(xlim)
         if ylim is not None:
             ax.set_ylim(ylim)
 
+        # Only the scatter plot is redrawn each frame
+        self.sctr = None
         ani = FuncAnimation(
             fig, 
             func=self.render, 
             init_func=self.init_render,
-            interval=40
+            interval=40,
+            blit=True
         )
 
         plt.show()
+
+
+def _simulate(args: tuple) -> np.ndarray:
+    """
+    Runs one simulation without rendering it.
+
+    Parameters
+    ----------
+    args : tuple
+        The arguments of run_simulations for one run, followed by the
+        random seed of the run.
+
+    Returns
+    -------
+    np.ndarray
+        The final positions of all agents.
+    """
+    (n_agents, step_size, grid_size, agent_creator,
+        assignment_type, n_steps, seed) = args
+
+    np.random.seed(seed)
+
+    # The processes already use all cores, so each simulation gets one thread
+    env = Environment(n_agents, step_size, grid_size, agent_creator, n_threads=1)
+    env.reset(assignment_type)
+    env.run_headless(n_steps)
+
+    return env.positions.copy()
+
+
+def run_simulations(
+        n_runs: int,
+        n_agents: int,
+        step_size: float,
+        grid_size: tuple,
+        agent_creator: AgentCreator,
+        assignment_type: str,
+        n_steps: int,
+        processes: int=None
+    ) -> list:
+    """
+    Runs independent simulations in parallel, one per process.
+
+    Parameters
+    ----------
+    n_runs : int
+        The number of simulations to run.
+    n_agents : int
+        The number of agents to use.
+    step_size : float
+        The amount of travel each agent does per step.
+    grid_size : tuple of two floats
+        The size of the 2D world.
+    agent_creator : Implementation of AgentCreator
+        Object which produces agents.
+    assignment_type : str
+        How to assign friends and enemies, see Environment.reset.
+    n_steps : int
+        The number of steps to take in each simulation.
+    processes : int, optional
+        The number of processes to use. Uses all cores if not given.
+
+    Returns
+    -------
+    list of np.ndarray
+        The final positions of all agents for each run.
+    """
+    # Each run gets its own seed drawn from the current random state, so
+    # the runs differ from each other and can be reproduced
+    seeds = np.random.randint(0, 2**31 - 1, size=n_runs)
+    args = [
+        (n_agents, step_size, grid_size, agent_creator,
+            assignment_type, n_steps, int(seed))
+        for seed in seeds
+    ]
+
+    # Forking a process whose numba threads are already running is not
+    # safe, so the workers are started fresh
+    with get_context("spawn").Pool(processes) as pool:
+        return pool.map(_simulate, args)
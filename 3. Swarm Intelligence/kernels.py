@@ -0,0 +1,656 @@
+import math
+from functools import lru_cache
+import numpy as np
+
+try:
+    import numba
+    from numba import cuda, njit, prange
+    NUMBA_AVAILABLE = True
+except ImportError:
+    NUMBA_AVAILABLE = False
+    prange = range
+
+    def njit(*args, **kwargs):
+        """
+        Stand-in for numba.njit which leaves the function as it is.
+        """
+        if len(args) == 1 and callable(args[0]):
+            return args[0]
+        return lambda func: func
+
+
+# Number of GPU threads, one per agent, in each block
+THREADS_PER_BLOCK = 256
+
+
+def cuda_available() -> bool:
+    """
+    Checks whether the agents can be moved on the GPU. Probing for a GPU
+    initialises the CUDA driver, so it is only done when asked for.
+
+    Returns
+    -------
+    bool
+        True if numba is available and finds a CUDA capable GPU.
+    """
+    return NUMBA_AVAILABLE and cuda.is_available()
+
+
+def set_num_threads(n_threads: int) -> None:
+    """
+    Sets the number of threads the kernels split the agents over.
+    Does nothing if numba is not available.
+
+    Parameters
+    ----------
+    n_threads : int
+        The number of threads to use. Can not exceed NUMBA_NUM_THREADS.
+    """
+    if NUMBA_AVAILABLE:
+        numba.set_num_threads(n_threads)
+
+
+@njit
+def _move_towards(px: float, py: float, x: float, y: float, step_size: float) -> tuple:
+    """
+    Get the new point where to travel towards a destination.
+
+    Parameters
+    ----------
+    px : float
+        Current horizontal position.
+    py : float
+        Current vertical position.
+    x : float
+        Horizontal position of the destination.
+    y : float
+        Vertical position of the destination.
+    step_size : float
+        The amount of travel performed each turn.
+
+    Returns
+    -------
+    tuple
+        New position where to travel.
+    """
+    dx = px - x
+    dy = py - y
+
+    # Make sure we don't overstep the destination. Comparing squared
+    # distances saves the square root when it is within reach.
+    n_squared = dx*dx + dy*dy
+    if n_squared <= step_size*step_size:
+        return x, y
+
+    inv = step_size / math.sqrt(n_squared)
+    return px - dx*inv, py - dy*inv
+
+
+# The destination functions below compute where a single agent wants to go
+# from the position of its friend (fx, fy), its enemy (ex, ey) and itself
+# (px, py). They share one signature so that the CPU and GPU kernels can use
+# them interchangeably, distance is only used by HidingAgent1.
+
+
+@njit
+def destination_protective1(fx, fy, ex, ey, px, py, distance) -> tuple:
+    """
+    The midpoint between the friend and the enemy. See ProtectiveAgent1.
+    """
+    return (fx + ex) * 0.5, (fy + ey) * 0.5
+
+
+@njit
+def destination_protective2(fx, fy, ex, ey, px, py, distance) -> tuple:
+    """
+    The closest point on the line segment between the friend and the
+    enemy. See ProtectiveAgent2.
+    """
+    fex = ex - fx
+    fey = ey - fy
+
+    # Project onto the line and clamp to the segment
+    denom = fex*fex + fey*fey
+    if denom == 0:
+        t = 0.0
+    else:
+        t = ((px-fx)*fex + (py-fy)*fey) / denom
+        t = min(max(t, 0.0), 1.0)
+
+    return fx + t*fex, fy + t*fey
+
+
+@njit
+def destination_hiding1(fx, fy, ex, ey, px, py, distance) -> tuple:
+    """
+    The point a set distance behind the friend. See HidingAgent1.
+    """
+    vx = fx - ex
+    vy = fy - ey
+    d_fe = math.sqrt(vx*vx + vy*vy)
+
+    # Move away from the enemy
+    if d_fe == 0:
+        scale = 0.0
+    else:
+        scale = distance / d_fe
+
+    return fx + scale*vx, fy + scale*vy
+
+
+@njit
+def destination_hiding2(fx, fy, ex, ey, px, py, distance) -> tuple:
+    """
+    The closest point behind the friend on the line through the friend
+    and the enemy. See HidingAgent2.
+    """
+    fex = ex - fx
+    fey = ey - fy
+
+    # Project onto the line if behind the friend, else go to the friend
+    dot = (px-fx)*fex + (py-fy)*fey
+    if dot >= 0:
+        t = 0.0
+    else:
+        t = dot / (fex*fex + fey*fey)
+
+    return fx + t*fex, fy + t*fey
+
+
+@njit(parallel=True, fastmath=True)
+def step_protective1(positions, friend_idx, enemy_idx, step_size, out) -> None:
+    """
+    Moves all agents towards the midpoint between their friend and enemy.
+    See ProtectiveAgent1.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    """
+    for i in prange(positions.shape[0]):
+        f = friend_idx[i]
+        e = enemy_idx[i]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        x, y = destination_protective1(
+            positions[f, 0], positions[f, 1],
+            positions[e, 0], positions[e, 1],
+            px, py, 0.0
+        )
+        out[i, 0], out[i, 1] = _move_towards(px, py, x, y, step_size)
+
+
+@njit(parallel=True, fastmath=True)
+def step_protective2(positions, friend_idx, enemy_idx, step_size, out) -> None:
+    """
+    Moves all agents the shortest way onto the line segment between their
+    friend and enemy. See ProtectiveAgent2.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    """
+    for i in prange(positions.shape[0]):
+        f = friend_idx[i]
+        e = enemy_idx[i]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        x, y = destination_protective2(
+            positions[f, 0], positions[f, 1],
+            positions[e, 0], positions[e, 1],
+            px, py, 0.0
+        )
+        out[i, 0], out[i, 1] = _move_towards(px, py, x, y, step_size)
+
+
+@njit(parallel=True, fastmath=True)
+def step_hiding1(positions, friend_idx, enemy_idx, step_size, out, distance) -> None:
+    """
+    Moves all agents towards a point a set distance behind their friend.
+    See HidingAgent1.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    distance : float
+        The distance away from the friend to travel.
+    """
+    for i in prange(positions.shape[0]):
+        f = friend_idx[i]
+        e = enemy_idx[i]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        x, y = destination_hiding1(
+            positions[f, 0], positions[f, 1],
+            positions[e, 0], positions[e, 1],
+            px, py, distance
+        )
+        out[i, 0], out[i, 1] = _move_towards(px, py, x, y, step_size)
+
+
+@njit(parallel=True, fastmath=True)
+def step_hiding2(positions, friend_idx, enemy_idx, step_size, out) -> None:
+    """
+    Moves all agents the shortest way to be behind their friend on the line
+    through the friend and the enemy. See HidingAgent2.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    """
+    for i in prange(positions.shape[0]):
+        f = friend_idx[i]
+        e = enemy_idx[i]
+        px = positions[i, 0]
+        py = positions[i, 1]
+        x, y = destination_hiding2(
+            positions[f, 0], positions[f, 1],
+            positions[e, 0], positions[e, 1],
+            px, py, 0.0
+        )
+        out[i, 0], out[i, 1] = _move_towards(px, py, x, y, step_size)
+
+
+@lru_cache(maxsize=None)
+def _cuda_kernel(destination):
+    """
+    Builds a CUDA kernel which moves every agent towards the point given by
+    a destination function, with one GPU thread per agent. The kernel is
+    compiled on its first launch.
+
+    Parameters
+    ----------
+    destination : callable
+        One of the destination functions of this module.
+
+    Returns
+    -------
+    numba.cuda dispatcher
+        Kernel taking positions, friend_idx, enemy_idx, step_size, distance
+        and out, all arrays on the GPU.
+    """
+    # Compile the same Python functions as the CPU kernels for the GPU
+    destination = cuda.jit(device=True)(destination.py_func)
+    move_towards = cuda.jit(device=True)(_move_towards.py_func)
+
+    @cuda.jit
+    def kernel(positions, friend_idx, enemy_idx, step_size, distance, out):
+        i = cuda.grid(1)
+        if i < positions.shape[0]:
+            f = friend_idx[i]
+            e = enemy_idx[i]
+            px = positions[i, 0]
+            py = positions[i, 1]
+            x, y = destination(
+                positions[f, 0], positions[f, 1],
+                positions[e, 0], positions[e, 1],
+                px, py, distance
+            )
+            out[i, 0], out[i, 1] = move_towards(px, py, x, y, step_size)
+
+    return kernel
+
+
+class CudaSwarm:
+    """
+    Keeps the positions of all agents on the GPU and moves them there.
+    Positions are only copied back to the host on request.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Starting positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    destination : callable
+        One of the destination functions of this module.
+    distance : float, optional
+        The distance away from the friend to travel, for HidingAgent1.
+    """
+
+    def __init__(self,
+            positions: np.ndarray,
+            friend_idx: np.ndarray,
+            enemy_idx: np.ndarray,
+            destination,
+            distance: float=0.0
+        ) -> None:
+        self.kernel = _cuda_kernel(destination)
+        self.distance = distance
+
+        # Double buffered positions and the friend and enemy indices
+        self.positions = cuda.to_device(positions)
+        self.positions_next = cuda.device_array_like(self.positions)
+        self.friend_idx = cuda.to_device(friend_idx)
+        self.enemy_idx = cuda.to_device(enemy_idx)
+
+        self.n_blocks = (positions.shape[0] + THREADS_PER_BLOCK - 1) // THREADS_PER_BLOCK
+
+        # Whether the host has seen the latest positions
+        self.synced = True
+
+        # Whether the host holds positions the GPU has not seen yet
+        self.stale = False
+
+    def step(self, step_size: float) -> None:
+        """
+        Moves all agents simultaneously.
+
+        Parameters
+        ----------
+        step_size : float
+            The amount of travel performed each turn.
+        """
+        self.kernel[self.n_blocks, THREADS_PER_BLOCK](
+            self.positions,
+            self.friend_idx,
+            self.enemy_idx,
+            step_size,
+            self.distance,
+            self.positions_next
+        )
+        self.positions, self.positions_next = self.positions_next, self.positions
+        self.synced = False
+
+    def copy_to_host(self, out: np.ndarray) -> None:
+        """
+        Copies the current positions from the GPU.
+
+        Parameters
+        ----------
+        out : np.ndarray
+            Host array of the same shape as the positions.
+        """
+        self.positions.copy_to_host(out)
+        self.synced = True
+
+    def copy_to_device(self, positions: np.ndarray) -> None:
+        """
+        Copies positions changed on the host to the GPU.
+
+        Parameters
+        ----------
+        positions : np.ndarray
+            Host array of the same shape as the positions.
+        """
+        self.positions.copy_to_device(
+            np.ascontiguousarray(positions, dtype=self.positions.dtype)
+        )
+        self.stale = False
+
+
+def allocate_work(n_agents: int, dtype: type=np.float32) -> tuple:
+    """
+    Allocates the scratch arrays used by the numpy kernels, so that a step
+    does not allocate any new arrays.
+
+    Parameters
+    ----------
+    n_agents : int
+        The number of agents.
+    dtype : type, optional
+        The data type of the positions.
+
+    Returns
+    -------
+    tuple
+        Two arrays of shape (n_agents, 2), two arrays of shape
+        (n_agents, 1) and a boolean array of shape (n_agents, 1).
+    """
+    return (
+        np.empty((n_agents, 2), dtype=dtype),
+        np.empty((n_agents, 2), dtype=dtype),
+        np.empty((n_agents, 1), dtype=dtype),
+        np.empty((n_agents, 1), dtype=dtype),
+        np.empty((n_agents, 1), dtype=bool)
+    )
+
+
+def _move_towards_vec(positions, destinations, step_size, out, norm, mask) -> None:
+    """
+    Moves all agents towards their destinations. The destinations, norm
+    and mask arrays are used as scratch space and overwritten.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    destinations : np.ndarray
+        Destination of each agent.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    norm : np.ndarray
+        Scratch array of shape (n_agents, 1).
+    mask : np.ndarray
+        Boolean scratch array of shape (n_agents, 1).
+    """
+    # Vectors from the destinations and their lengths
+    D = destinations
+    np.subtract(positions, destinations, out=D)
+    np.multiply(D, D, out=out)
+    np.sum(out, axis=1, keepdims=True, out=norm)
+    np.sqrt(norm, out=norm)
+
+    # Make sure we don't overstep the destination, min(norm, step_size)/norm
+    # is min(1, step_size/norm). Agents at their destination keep zero.
+    np.greater(norm, 0, out=mask)
+    np.divide(step_size, norm, out=norm, where=mask)
+    np.minimum(norm, 1.0, out=norm)
+    D *= norm
+
+    np.subtract(positions, D, out=out)
+
+
+def _project_vec(positions, friend_idx, enemy_idx, out, work) -> tuple:
+    """
+    Projects all agents onto the line through their friend and enemy.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    out : np.ndarray
+        Array of the same shape as positions, used as scratch space.
+    work : tuple
+        Scratch arrays from allocate_work.
+
+    Returns
+    -------
+    tuple
+        The friend positions, the vectors from the friends to the enemies
+        and the projections t, where t = 0 is the friend and t = 1 is the
+        enemy. All three are arrays from work.
+    """
+    F, FE, t, norm, mask = work
+    np.take(positions, friend_idx, axis=0, out=F)
+    np.take(positions, enemy_idx, axis=0, out=FE)
+    FE -= F
+
+    # t = ((p-f).(e-f)) / |e-f|^2
+    np.subtract(positions, F, out=out)
+    out *= FE
+    np.sum(out, axis=1, keepdims=True, out=t)
+    np.multiply(FE, FE, out=out)
+    np.sum(out, axis=1, keepdims=True, out=norm)
+
+    # A friend and enemy in the same spot keep t = 0, the friend
+    np.greater(norm, 0, out=mask)
+    np.divide(t, norm, out=t, where=mask)
+
+    return F, FE, t
+
+
+def step_protective1_vec(positions, friend_idx, enemy_idx, step_size, out, work) -> None:
+    """
+    Numpy version of step_protective1.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    work : tuple
+        Scratch arrays from allocate_work.
+    """
+    F, E, _, norm, mask = work
+    np.take(positions, friend_idx, axis=0, out=F)
+    np.take(positions, enemy_idx, axis=0, out=E)
+
+    # The midpoints are stored in place of the friend positions
+    np.add(F, E, out=F)
+    F *= 0.5
+
+    _move_towards_vec(positions, F, step_size, out, norm, mask)
+
+
+def step_protective2_vec(positions, friend_idx, enemy_idx, step_size, out, work) -> None:
+    """
+    Numpy version of step_protective2.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    work : tuple
+        Scratch arrays from allocate_work.
+    """
+    F, FE, t = _project_vec(positions, friend_idx, enemy_idx, out, work)
+
+    # Clamp to the segment, the destinations are stored in F
+    np.clip(t, 0.0, 1.0, out=t)
+    FE *= t
+    F += FE
+
+    _move_towards_vec(positions, F, step_size, out, work[3], work[4])
+
+
+def step_hiding1_vec(positions, friend_idx, enemy_idx, step_size, out, work, distance) -> None:
+    """
+    Numpy version of step_hiding1.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    work : tuple
+        Scratch arrays from allocate_work.
+    distance : float
+        The distance away from the friend to travel.
+    """
+    F, V, d, d_fe, mask = work
+    np.take(positions, friend_idx, axis=0, out=F)
+    np.take(positions, enemy_idx, axis=0, out=V)
+    np.subtract(F, V, out=V)
+
+    np.multiply(V, V, out=out)
+    np.sum(out, axis=1, keepdims=True, out=d_fe)
+    np.sqrt(d_fe, out=d_fe)
+
+    # Move away from the enemy, see HidingAgent1. A friend and enemy in the
+    # same spot give the friend as the destination.
+    d.fill(0.0)
+    np.greater(d_fe, 0, out=mask)
+    np.divide(distance, d_fe, out=d, where=mask)
+
+    # The destinations are stored in F
+    V *= d
+    F += V
+
+    _move_towards_vec(positions, F, step_size, out, d_fe, mask)
+
+
+def step_hiding2_vec(positions, friend_idx, enemy_idx, step_size, out, work) -> None:
+    """
+    Numpy version of step_hiding2.
+
+    Parameters
+    ----------
+    positions : np.ndarray
+        Positions of all agents, one row per agent.
+    friend_idx : np.ndarray
+        Row index of each agent's friend.
+    enemy_idx : np.ndarray
+        Row index of each agent's enemy.
+    step_size : float
+        The amount of travel performed each turn.
+    out : np.ndarray
+        Array of the same shape as positions to write the new positions to.
+    work : tuple
+        Scratch arrays from allocate_work.
+    """
+    F, FE, t = _project_vec(positions, friend_idx, enemy_idx, out, work)
+
+    # Only agents behind the friend go to the projection, the destinations
+    # are stored in F
+    np.minimum(t, 0.0, out=t)
+    FE *= t
+    F += FE
+
+    _move_towards_vec(positions, F, step_size, out, work[3], work[4])